@@ -1,31 +1,248 @@
 import json
 import boto3
+import copy
+import logging
 import os
+import random
+import re
 import uuid
 import time
-from datetime import datetime, timedelta
+import hashlib
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
 from decimal import Decimal
+from functools import lru_cache
+from boto3.dynamodb.types import Binary, TypeSerializer
 from botocore.exceptions import ClientError
 from botocore.config import Config as BotoConfig
 
+# orjson is a fast path for the Titan request/response (a 1536-float payload). The CDK
+# bundling step installs it from requirements.txt; stdlib json covers unbundled local runs
+try:
+    import orjson
+    _json_dumps, _json_loads = orjson.dumps, orjson.loads
+except ImportError:
+    _json_dumps, _json_loads = json.dumps, json.loads
+
+# msgspec (also from requirements.txt) decodes the Titan response straight into a typed
+# struct, skipping every field but the embedding
+try:
+    import msgspec
+
+    class _TitanEmbeddingResponse(msgspec.Struct):
+        embedding: list[float] | None = None
+
+    _titan_decoder = msgspec.json.Decoder(_TitanEmbeddingResponse)
+except ImportError:
+    _titan_decoder = None
+
+# Logging — INFO by default; DEBUG payload dumps are sampled on DEBUG_SAMPLE_RATE of invocations.
+# Sampling only touches this module's logger: the root logger stays at INFO so botocore/urllib3
+# never log request params, model responses or signing details.
+logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
+DEBUG_SAMPLE_RATE = float(os.environ.get("DEBUG_SAMPLE_RATE", "0.01"))
+
 # Model and embedding configuration
 MODEL_ID = "us.amazon.nova-pro-v1:0"
 EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"  # Using v1 for compatibility with existing embeddings
 FALLBACK_MODEL_ID = os.environ.get("FALLBACK_MODEL_ID", "us.amazon.nova-lite-v1:0")
+# Trivial diffs (one file, a handful of changed lines, no new definitions) go to the smaller model
+SIMPLE_MODEL_ID = os.environ.get("SIMPLE_MODEL_ID", "us.amazon.nova-lite-v1:0")
+SIMPLE_DIFF_MAX_CHANGED_LINES = 20
+# Prompt budget for the diff — input tokens dominate extraction latency on large pushes
+PROMPT_HUNK_MAX_LINES = 40
+PROMPT_DIFF_MAX_CHARS = 8 * 1024
+EXTRACTION_MAX_TOKENS = 512
+# Entity/task-heavy pushes can overrun the tight budget — those are retried once at the old limit
+EXTRACTION_RETRY_MAX_TOKENS = 2000
+# Bedrock latency-optimized inference ("optimized" | "standard"). Models or regions without
+# support reject performanceConfig with a ValidationException and are retried on the standard tier.
+BEDROCK_LATENCY_MODE = os.environ.get("BEDROCK_LATENCY_MODE", "optimized")
 
 # DynamoDB table names (set via environment variables or hardcoded for prototype)
 CONTEXT_TABLE = os.environ.get("CONTEXT_TABLE", "flowsync-context")
 AUDIT_TABLE = os.environ.get("AUDIT_TABLE", "flowsync-audit")
 PROJECTS_TABLE = os.environ.get("PROJECTS_TABLE", "flowsync-projects")
+EMBEDDING_CACHE_TABLE = os.environ.get("EMBEDDING_CACHE_TABLE", "flowsync-embedding-cache")
+
+# Embedding cache — identical extraction text always yields the same Titan vector
+EMBEDDING_CACHE_MAX_ENTRIES = 512            # in-process LRU, survives warm starts
+EMBEDDING_CACHE_TTL_SECONDS = 7 * 24 * 3600  # DynamoDB tier, auto-expired via TTL
+# Extraction cache — retried/replayed events (Lambda async retries, DLQ redrives, CI re-runs)
+# repeat the exact same prompt, and a small warm-container LRU absorbs most of them
+EXTRACTION_CACHE_MAX_ENTRIES = 256
+
+# SQS worker: a record is only started with at least this much invocation time left (the
+# single-event timeout the function had before batching); the rest go back to the queue.
+# A degraded record (Bedrock retries, throttle fallback, Titan) can still overrun it.
+RECORD_TIME_BUDGET_MS = 60 * 1000
+
+# Log-first linking: an uncommitted record is bound to a commit pushed within this window
+ORPHAN_WINDOW_MS = 30 * 60 * 1000
+_ISO_UTC_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Merge propagation is redelivered on failure — a copy's eventId is derived from its source
+# record and target branch, so a retry finds the copies it already wrote instead of duplicating them
+_PROPAGATION_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'flowsync/branch-propagation')
+
+# Markdown code fence around model output — ```json ... ``` or ``` ... ```; the closing
+# fence is optional because truncated output often stops before it
+_JSON_FENCE_RE = re.compile(r'^```(?:json)?\s*(.*?)\s*(?:```|$)', re.DOTALL)
+# Added line that introduces a function or class (Python / JS / TS)
+_NEW_DEFINITION_RE = re.compile(
+    r'^\+\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function)\b', re.MULTILINE
+)
+
+# AWS clients are created lazily on first use — cold starts only pay for what the event
+# needs (the orphan-link path never builds a Bedrock client)
+def _lazy(factory):
+    """Build the wrapped client/resource on first call and return the same instance afterwards."""
+    return lru_cache(maxsize=None)(factory)
+
+# Shared client config — adaptive retry handles ThrottlingException (429) with exponential backoff;
+# keep-alive connections avoid fresh TLS handshakes on warm invocations
+_boto_config = BotoConfig(
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=1,
+    read_timeout=10,
+)
+# Model generation legitimately takes longer than a DynamoDB or CloudWatch call
+_bedrock_config = _boto_config.merge(BotoConfig(read_timeout=30))
+
+@_lazy
+def _bedrock():
+    return boto3.client("bedrock-runtime", config=_bedrock_config)
+
+@_lazy
+def _ddb():
+    return boto3.resource("dynamodb", config=_boto_config)
+
+@_lazy
+def _ddb_client():
+    """Low-level client for TransactWriteItems."""
+    return boto3.client("dynamodb", config=_boto_config)
+
+@_lazy
+def _cw():
+    return boto3.client("cloudwatch", config=_boto_config)
+
+# Table handles are built once per container, not once per call
+@_lazy
+def _context_table():
+    return _ddb().Table(CONTEXT_TABLE)
+
+@_lazy
+def _audit_table():
+    return _ddb().Table(AUDIT_TABLE)
+
+@_lazy
+def _embedding_cache_table():
+    return _ddb().Table(EMBEDDING_CACHE_TABLE)
+
+class _LruCache:
+    """Small bounded LRU kept at module scope so entries are reused across warm invocations."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+_embedding_lru = _LruCache(EMBEDDING_CACHE_MAX_ENTRIES)
+_extraction_lru = _LruCache(EXTRACTION_CACHE_MAX_ENTRIES)
+
+# Models that rejected latency-optimized inference in this container — skip the retry next time
+_standard_latency_models = set()
+
+# CloudWatch metrics recorded during the current invocation — flushed in one put_metric_data,
+# each tagged with the project of the event that was being processed when it was recorded
+_pending_metrics = []
+_metric_project_id = "test-project"
+
+def converse(model_id, system_prompt, user_prompt, max_tokens=EXTRACTION_MAX_TOKENS):
+    """Call the Bedrock Converse API, requesting latency-optimized inference where the model supports it."""
+    request = {
+        "modelId": model_id,
+        "system": [{"text": system_prompt}],
+        "messages": [{"role": "user", "content": [{"text": user_prompt}]}],
+        "inferenceConfig": {"maxTokens": max_tokens, "temperature": 0, "topP": 1},
+    }
+    if BEDROCK_LATENCY_MODE == 'optimized' and model_id not in _standard_latency_models:
+        try:
+            return _bedrock().converse(**request, performanceConfig={"latency": "optimized"})
+        except ClientError as e:
+            # Other ValidationExceptions (e.g. input too long) would fail the standard call too
+            error = e.response['Error']
+            message = error.get('Message', '').lower()
+            if error['Code'] != 'ValidationException' or ('performanceconfig' not in message and 'latency' not in message):
+                raise
+            logger.warning(f"Latency-optimized inference not available for {model_id}, using standard")
+            _standard_latency_models.add(model_id)
+    return _bedrock().converse(**request)
+
+def iso_to_epoch_ms(timestamp):
+    """Parse an ISO-8601 timestamp (trailing 'Z' and fractional seconds allowed) into epoch milliseconds."""
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+def utc_now_iso():
+    """Current UTC time as an ISO-8601 string, for events that arrive without a timestamp."""
+    return time.strftime(_ISO_UTC_FORMAT, time.gmtime())
+
+def classify_diff(diff, changed_files):
+    """Cheap triage of a diff: 'simple' (single file, few changed lines, no new definitions) or 'complex'."""
+    file_count = max(diff.count('diff --git'), len(changed_files))
+    changed_lines = sum(
+        1 for line in diff.splitlines()
+        if line.startswith(('+', '-')) and not line.startswith(('+++', '---'))
+    )
+    if file_count <= 1 and changed_lines <= SIMPLE_DIFF_MAX_CHANGED_LINES and not _NEW_DEFINITION_RE.search(diff):
+        return 'simple'
+    return 'complex'
 
-# Bedrock client with adaptive retry — handles ThrottlingException (429) with exponential backoff
-_bedrock_retry_config = BotoConfig(retries={'max_attempts': 3, 'mode': 'adaptive'})
-bedrock_client = boto3.client("bedrock-runtime", config=_bedrock_retry_config)
-dynamodb = boto3.resource("dynamodb")
-cloudwatch = boto3.client("cloudwatch")
+DIFF_TIER_MODELS = {'simple': SIMPLE_MODEL_ID, 'complex': MODEL_ID}
+
+def compress_diff(diff):
+    """
+    Shrink a diff for the extraction prompt: keep file/hunk headers and changed lines only,
+    at most PROMPT_HUNK_MAX_LINES changed lines per hunk, capped at PROMPT_DIFF_MAX_CHARS.
+    """
+    kept = []
+    hunk_lines = 0
+    for line in diff.splitlines():
+        if line.startswith(('diff --git', '@@')):
+            kept.append(line)
+            hunk_lines = 0
+        elif line.startswith(('+', '-')):
+            hunk_lines += 1
+            if hunk_lines <= PROMPT_HUNK_MAX_LINES:
+                kept.append(line)
+            elif hunk_lines == PROMPT_HUNK_MAX_LINES + 1:
+                kept.append('... (hunk truncated)')
+    # Not a unified diff (e.g. a bare snippet) — fall back to the raw text
+    compressed = '\n'.join(kept) or diff
+    if len(compressed) > PROMPT_DIFF_MAX_CHARS:
+        compressed = compressed[:PROMPT_DIFF_MAX_CHARS] + '\n... (diff truncated)'
+    return compressed
 
 def call_bedrock(event_data):
-    """Call Nova Pro via Bedrock Converse API with commit metadata and return extracted context as JSON."""
+    """
+    Call Bedrock via the Converse API with commit metadata and return extracted context as JSON.
+    Simple diffs are routed to SIMPLE_MODEL_ID (Nova Lite); everything else goes to Nova Pro.
+    """
     diff         = event_data.get('diff', '')
     commit_hash  = event_data.get('commitHash', '')
     message      = event_data.get('message', '')
@@ -46,61 +263,55 @@ Author: {author}
 Branch: {branch}
 Changed Files: {', '.join(changed_files) if changed_files else 'not provided'}
 
-Diff:
-{diff}
-
-Return ONLY a valid JSON object with this exact structure:
-{{
-  "feature": "name of the feature or module being modified (e.g. 'Auth pipeline', 'Event ingestion', 'Dashboard UI')",
-  "decision": "<see rules below>",
-  "tasks": ["specific remaining task inferred from TODOs, partial implementations, or stub functions — empty array if none visible"],
-  "stage": "one of: Setup | Feature Development | Refactoring | Bug Fix | Testing | Documentation",
-  "risk": "a concrete risk visible in the diff (e.g. 'No error handling on DB write', 'Token logged in plaintext', 'No input validation') — null if none",
-  "entities": ["every function name, class name, or filename directly modified in this diff"]
-}}
-
-Rules for 'decision' field:
-- SET to a concise string when the diff shows ANY of these patterns:
-    * One technology/library/approach REPLACED by another (e.g. removed bcrypt import, added scrypt call)
-    * An explicit design choice in data structures (e.g. storing token as salt:hash, using GSI for query)
-    * A new architectural pattern introduced (e.g. fire-and-forget async invoke, singleton SDK client)
-    * A change in API style or protocol (e.g. switched from invoke_model to converse API)
-    * A security or performance tradeoff made explicit in the code or commit message
-    * Added/removed a dependency that implies a deliberate choice
-- SET to null ONLY when the diff is purely additive content with no technology or approach choice visible
-- Be specific: write WHAT was chosen and WHY if evident (e.g. 'Used Bedrock Converse API over invoke_model for model-agnostic interface')
+Diff (changed lines only, long hunks truncated):
+{compress_diff(diff)}
+
+Return ONLY a JSON object. Schema: {{feature:str, decision:str|null, tasks:[str], stage:enum[Setup,Feature Development,Refactoring,Bug Fix,Testing,Documentation], risk:str|null, entities:[str]}}
+- feature: feature or module being modified (e.g. 'Auth pipeline')
+- tasks: remaining work implied by TODOs, partial implementations or stubs; [] if none
+- risk: one concrete risk visible in the diff (e.g. 'No input validation'); null if none
+- entities: every function, class or filename directly modified
+- decision: WHAT was chosen and WHY if evident, when the diff replaces one technology/approach with another, makes an explicit data-structure, architecture, API/protocol, security or performance choice, or deliberately adds/removes a dependency; null ONLY for purely additive changes with no such choice
 
 Extract only factual information present in the diff and message. Do not invent or assume."""
 
     # Bedrock Converse API — works with Nova Pro and all Amazon/Meta models
-    # Falls back to FALLBACK_MODEL_ID (Nova Lite) if Nova Pro throttles
+    # Falls back to FALLBACK_MODEL_ID (Nova Lite) if the routed model throttles
+    diff_tier = classify_diff(diff, changed_files)
+    model_used = DIFF_TIER_MODELS[diff_tier]
+
+    # Identical prompt → identical extraction (temperature 0); skip the model round-trip on repeats
+    cache_key = hashlib.blake2b(f"{system_prompt}\0{user_prompt}".encode(), digest_size=16).digest()
+    cached = _extraction_lru.get(cache_key)
+    if cached is not None:
+        logger.info("BEDROCK_TIMING cache_hit=true duration_ms=0")
+        record_metric('ExtractionCacheHit', 1)
+        result = copy.deepcopy(cached)
+        result['_bedrock_duration_ms'] = 0
+        return result
+
     t0 = time.time()
-    model_used = MODEL_ID
     try:
-        response = bedrock_client.converse(
-            modelId=MODEL_ID,
-            system=[{"text": system_prompt}],
-            messages=[{"role": "user", "content": [{"text": user_prompt}]}],
-            inferenceConfig={"maxTokens": 2000, "temperature": 0, "topP": 1}
-        )
+        response = converse(model_used, system_prompt, user_prompt)
     except ClientError as e:
         error_code = e.response['Error']['Code']
-        if error_code in ('ThrottlingException', 'ModelTimeoutException', 'ServiceUnavailableException'):
-            print(f"Nova Pro throttled ({error_code}), falling back to {FALLBACK_MODEL_ID}")
+        if model_used != FALLBACK_MODEL_ID and error_code in ('ThrottlingException', 'ModelTimeoutException', 'ServiceUnavailableException'):
+            logger.warning(f"{model_used} throttled ({error_code}), falling back to {FALLBACK_MODEL_ID}")
             model_used = FALLBACK_MODEL_ID
-            response = bedrock_client.converse(
-                modelId=FALLBACK_MODEL_ID,
-                system=[{"text": system_prompt}],
-                messages=[{"role": "user", "content": [{"text": user_prompt}]}],
-                inferenceConfig={"maxTokens": 2000, "temperature": 0, "topP": 1}
-            )
+            response = converse(FALLBACK_MODEL_ID, system_prompt, user_prompt)
         else:
             raise
+    # Truncated JSON would fail parsing and be recorded as a permanent schema failure
+    if response.get('stopReason') == 'max_tokens':
+        logger.warning(f"{model_used} hit maxTokens={EXTRACTION_MAX_TOKENS}, retrying with {EXTRACTION_RETRY_MAX_TOKENS}")
+        record_metric('ExtractionTruncated', 1)
+        response = converse(model_used, system_prompt, user_prompt, max_tokens=EXTRACTION_RETRY_MAX_TOKENS)
     bedrock_duration_ms = int((time.time() - t0) * 1000)
 
     usage = response.get('usage', {})
-    print(f"BEDROCK_TIMING input_tokens={usage.get('inputTokens', 0)} output_tokens={usage.get('outputTokens', 0)} duration_ms={bedrock_duration_ms}")
-    print(f"Bedrock response metadata: {json.dumps(usage, default=str)}")
+    logger.info(f"BEDROCK_TIMING input_tokens={usage.get('inputTokens', 0)} output_tokens={usage.get('outputTokens', 0)} duration_ms={bedrock_duration_ms}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Bedrock response metadata: {json.dumps(usage, default=str)}")
 
     # Converse API response format: output.message.content[0].text
     try:
@@ -109,12 +320,17 @@ Extract only factual information present in the diff and message. Do not invent
         raise ValueError(f"Unexpected Bedrock Converse response structure: {e}. Response: {response}")
 
     # Strip markdown code fences if present
-    if output_text.startswith('```json'):
-        output_text = output_text.split('```json')[1].split('```')[0].strip()
-    elif output_text.startswith('```'):
-        output_text = output_text.split('```')[1].split('```')[0].strip()
-
-    result = json.loads(output_text)
+    fenced = _JSON_FENCE_RE.match(output_text)
+    if fenced:
+        output_text = fenced.group(1)
+
+    # parse_float=Decimal: any numbers in the extraction are DynamoDB-ready as parsed
+    result = json.loads(output_text, parse_float=Decimal)
+    result['_model_used'] = model_used
+    result['_diff_tier'] = diff_tier
+    # Only cache extractions that pass validation, so a retry can still recover from a bad one
+    validate_extraction_schema(result)
+    _extraction_lru.put(cache_key, copy.deepcopy(result))
     result['_bedrock_duration_ms'] = bedrock_duration_ms
     return result
 
@@ -151,134 +367,307 @@ def compute_confidence(extraction):
         score += 0.05
     return round(min(score, 1.0), 2)
 
-def convert_floats_to_decimal(obj):
-    """Convert all float values to Decimal for DynamoDB compatibility."""
-    if isinstance(obj, list):
-        return [convert_floats_to_decimal(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_floats_to_decimal(value) for key, value in obj.items()}
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    else:
-        return obj
-
-def call_titan_embedding(text):
+def invoke_titan_embedding(text):
     """Call Titan Embeddings to generate a vector for the given text."""
-    t0 = time.time()
-    response = bedrock_client.invoke_model(
+    response = _bedrock().invoke_model(
         modelId=EMBEDDING_MODEL_ID,
         contentType="application/json",
         accept="application/json",
-        body=json.dumps({"inputText": text})
+        body=_json_dumps({"inputText": text})
     )
-    result = json.loads(response["body"].read())
-    embedding = result.get("embedding")
+    body = response["body"].read()
+    if _titan_decoder is not None:
+        embedding = _titan_decoder.decode(body).embedding   # msgspec.DecodeError is a ValueError
+    else:
+        embedding = _json_loads(body).get("embedding")
     if not embedding or len(embedding) != 1536:
         raise ValueError("Titan embedding output shape invalid.")
+    return embedding
+
+def pack_embedding(embedding):
+    """Pack an embedding as float32 bytes — 6 KB vs ~25 KB as a list of DynamoDB numbers."""
+    return array('f', embedding).tobytes()
+
+def quantize_embedding(packed):
+    """
+    Quantize packed float32 embedding bytes to int8 with a single per-vector scale.
+    1536 bytes + one Decimal instead of 6144 bytes — cosine ranking is preserved
+    because every component shares the same scale.
+    """
+    values = array('f', packed)
+    peak = max(abs(v) for v in values)
+    scale = peak / 127 if peak else 1.0
+    quantized = array('b', [round(v / scale) for v in values])
+    return Binary(quantized.tobytes()), Decimal(str(scale))
+
+def read_cached_embedding(cache_key):
+    """Look up a previously computed embedding in the DynamoDB cache. Returns packed float32 bytes or None."""
+    try:
+        item = _embedding_cache_table().get_item(
+            Key={'hash': cache_key}, ConsistentRead=False
+        ).get('Item')
+        if item:
+            return item['embedding'].value
+    except Exception as e:
+        logger.warning(f"Embedding cache read failed (non-fatal): {str(e)}")
+    return None
+
+def write_cached_embedding(cache_key, packed):
+    """Persist packed embedding bytes to the DynamoDB cache with a 7-day TTL."""
+    try:
+        _embedding_cache_table().put_item(Item={
+            'hash': cache_key,
+            'embedding': Binary(packed),
+            'ttl': int(time.time()) + EMBEDDING_CACHE_TTL_SECONDS,
+        })
+    except Exception as e:
+        logger.warning(f"Embedding cache write failed (non-fatal): {str(e)}")
+
+def call_titan_embedding(text):
+    """
+    Return the Titan embedding for text, skipping the InvokeModel round-trip on cache hits.
+    Lookup order: warm-container LRU → DynamoDB embedding cache → Titan.
+    Returns the embedding as packed float32 bytes.
+    """
+    t0 = time.time()
+    cache_key = hashlib.sha256(text.encode()).hexdigest()
+    source = 'memory'
+    packed = _embedding_lru.get(cache_key)
+    if packed is None:
+        source = 'dynamodb'
+        packed = read_cached_embedding(cache_key)
+        if packed is None:
+            source = 'titan'
+            packed = pack_embedding(invoke_titan_embedding(text))
+            write_cached_embedding(cache_key, packed)
+        _embedding_lru.put(cache_key, packed)
+    if source != 'titan':
+        record_metric('EmbeddingCacheHit', 1)
     embedding_duration_ms = int((time.time() - t0) * 1000)
-    print(f"EMBEDDING_TIMING duration_ms={embedding_duration_ms} dims={len(embedding)}")
-    return embedding, embedding_duration_ms
+    logger.info(f"EMBEDDING_TIMING duration_ms={embedding_duration_ms} dims={len(packed) // 4} source={source}")
+    return packed, embedding_duration_ms
 
 def write_context_record(context_record):
     """Write the context record to DynamoDB."""
-    table = dynamodb.Table(CONTEXT_TABLE)
-    # Convert floats to Decimal for DynamoDB compatibility
-    context_record = convert_floats_to_decimal(context_record)
-    table.put_item(Item=context_record)
-
-def write_audit_record(audit_record):
-    """Write the audit record to DynamoDB."""
-    table = dynamodb.Table(AUDIT_TABLE)
-    table.put_item(Item=audit_record)
-
-def update_project_activity(project_id, timestamp):
-    """Update lastActivityAt and increment eventCount in projects table."""
-    table = dynamodb.Table(PROJECTS_TABLE)
-    table.update_item(
-        Key={"projectId": project_id},
-        UpdateExpression="SET lastActivityAt = :ts ADD eventCount :inc",
-        ExpressionAttributeValues={":ts": timestamp, ":inc": 1}
-    )
+    _context_table().put_item(Item=context_record)
+
+_serializer = TypeSerializer()
 
-def find_orphaned_record(project_id, branch, author, timestamp):
+def _marshal(item):
+    """Convert a plain dict into DynamoDB's low-level attribute-value format."""
+    return {key: _serializer.serialize(value) for key, value in item.items()}
+
+def pending_record_key(project_id, branch, author):
     """
-    Find an uncommitted record (commitHash: null) for the same branch and author
-    within 30 minutes of the given timestamp. Direction B: log-first scenario.
+    Deterministic context-table key of the pointer to the latest uncommitted record for
+    (project, branch, author). Must match the key written by the MCP log_context tool.
+    """
+    return f"PENDING#{project_id}#{branch}#{author}"
+
+def pending_pointer_item(context_record):
+    """
+    Pointer item for an uncommitted record. It carries no projectId/extractedAt attributes,
+    so it stays out of ProjectContextIndex and BranchContextIndex.
+    """
+    return {
+        'eventId':        pending_record_key(context_record['projectId'], context_record['branch'], context_record['author']),
+        'pendingEventId': context_record['eventId'],
+        'pendingSince':   context_record['extractedAt'],     # human-readable, for debugging
+        'pendingSinceMs': context_record['extractedAtMs'],
+    }
+
+def _cancellation_reasons(error):
+    """Per-item codes of a cancelled transaction, in TransactItems order ('None' where the item's condition held)."""
+    if error.response['Error']['Code'] != 'TransactionCanceledException':
+        raise error
+    return [reason.get('Code') for reason in error.response.get('CancellationReasons', [])]
+
+# An event's own audit entry (entityId = eventId, timestamp = event timestamp) is written at most
+# once, in the same transaction as its other writes — it doubles as the event's idempotency key
+_AUDIT_ONCE = 'attribute_not_exists(entityId)'
+_PROCESSED_ACTIONS = ('context_extracted', 'commit_linked')
+
+def already_processed(event_id, timestamp):
+    """
+    True if an earlier delivery of this event already committed its writes. SQS is at-least-once
+    and a timed-out batch is redelivered whole, so this is checked before any Bedrock call.
     """
-    table = dynamodb.Table(CONTEXT_TABLE)
-    
-    # Calculate time window (30 minutes before timestamp)
-    time_obj = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-    window_start = (time_obj - timedelta(minutes=30)).isoformat().replace('+00:00', 'Z')
-    
     try:
-        # BranchContextIndex GSI: PK=projectId, SK=branch#extractedAt
-        # Filter for uncommitted records (commitHash is None) by this author
-        response = table.query(
-            IndexName='BranchContextIndex',
-            KeyConditionExpression='projectId = :pk AND branchExtractedAt BETWEEN :start AND :end',
-            FilterExpression='commitHash = :null AND author = :author',
-            ExpressionAttributeValues={
-                ':pk': project_id,
-                ':start': f"{branch}#{window_start}",
-                ':end': f"{branch}#{timestamp}",
-                ':null': None,
-                ':author': author
-            },
-            Limit=1,
-            ScanIndexForward=False  # Most recent first
+        item = _audit_table().get_item(
+            Key={'entityId': event_id, 'timestamp': timestamp}, ConsistentRead=True
+        ).get('Item')
+    except ClientError as e:
+        logger.warning(f"Processed-event check failed (non-fatal): {str(e)}")
+        return False
+    return bool(item) and item.get('action') in _PROCESSED_ACTIONS
+
+def write_extraction_records(context_record, audit_record, project_id, timestamp):
+    """
+    Write the context record, audit record and project activity update as one
+    TransactWriteItems call — a single round-trip, and no partial writes on failure.
+    Uncommitted records also get their pending pointer in the same transaction.
+    Returns False if an earlier delivery of the event already wrote them.
+    """
+    transact_items = [
+        {'Put': {'TableName': CONTEXT_TABLE, 'Item': _marshal(context_record)}},
+        {'Put': {'TableName': AUDIT_TABLE, 'Item': _marshal(audit_record), 'ConditionExpression': _AUDIT_ONCE}},
+        {'Update': {
+            'TableName': PROJECTS_TABLE,
+            'Key': _marshal({'projectId': project_id}),
+            'UpdateExpression': 'SET lastActivityAt = :ts ADD eventCount :inc',
+            'ExpressionAttributeValues': _marshal({':ts': timestamp, ':inc': 1}),
+        }},
+    ]
+    if context_record['commitHash'] is None:
+        transact_items.append(
+            {'Put': {'TableName': CONTEXT_TABLE, 'Item': _marshal(pending_pointer_item(context_record))}}
         )
+    try:
+        _ddb_client().transact_write_items(TransactItems=transact_items)
+    except ClientError as e:
+        if _cancellation_reasons(e)[1:2] != ['ConditionalCheckFailed']:
+            raise
+        logger.info(f"Event {context_record['eventId']} was already written by an earlier delivery")
+        return False
+    return True
+
+def record_propagation(project_id, source_branch, target_branch, timestamp, count):
+    """
+    Write the propagation audit record and the project activity update as one TransactWriteItems
+    call. The audit Put only applies once per (merge, timestamp), so a redelivered propagation
+    does not increment eventCount again.
+    """
+    audit_record = {
+        "entityId": f"PROPAGATE#{project_id}#{source_branch}#{target_branch}",
+        "timestamp": timestamp,
+        "action": "branch_propagated",
+        "projectId": project_id,
+        "branch": target_branch,
+        "mergedFrom": source_branch,
+        "recordCount": count,
+    }
+    try:
+        _ddb_client().transact_write_items(TransactItems=[
+            {'Put': {
+                'TableName': AUDIT_TABLE,
+                'Item': _marshal(audit_record),
+                'ConditionExpression': 'attribute_not_exists(entityId)',
+            }},
+            {'Update': {
+                'TableName': PROJECTS_TABLE,
+                'Key': _marshal({'projectId': project_id}),
+                'UpdateExpression': 'SET lastActivityAt = :ts ADD eventCount :inc',
+                'ExpressionAttributeValues': _marshal({':ts': timestamp, ':inc': 1}),
+            }},
+        ])
+    except ClientError as e:
+        if _cancellation_reasons(e)[:1] != ['ConditionalCheckFailed']:
+            raise
+        logger.info(f"[propagate] '{source_branch}' → '{target_branch}' at {timestamp} already recorded")
+
+def find_orphaned_record(project_id, branch, author, timestamp_ms):
+    """
+    Find an uncommitted record (commitHash: null) for the same branch and author
+    within 30 minutes before timestamp_ms (epoch ms). Direction B: log-first scenario.
+    Reads the deterministic pending pointer with one get_item; returns {'eventId': ...} or None.
+    """
+    try:
+        # One pointer per (project, branch, author), always naming the most recent uncommitted record
+        # Strongly consistent — a just-written or just-deleted pointer must be seen as such
+        pointer = _context_table().get_item(
+            Key={'eventId': pending_record_key(project_id, branch, author)},
+            ConsistentRead=True
+        ).get('Item')
         
-        if response.get('Items'):
-            return response['Items'][0]
+        if pointer and 0 <= timestamp_ms - int(pointer['pendingSinceMs']) <= ORPHAN_WINDOW_MS:
+            return {'eventId': pointer['pendingEventId']}
         return None
     except ClientError as e:
-        print(f"Error finding orphaned record: {str(e)}")
+        logger.error(f"Error finding orphaned record: {str(e)}")
         return None
 
-def update_orphaned_record(event_id, commit_hash, timestamp):
-    """Bind commitHash to an existing uncommitted record."""
-    table = dynamodb.Table(CONTEXT_TABLE)
-    table.update_item(
-        Key={"eventId": event_id},
-        UpdateExpression="SET commitHash = :hash, #status = :status, committedAt = :ts",
-        ExpressionAttributeNames={'#status': 'status'},
-        ExpressionAttributeValues={
-            ':hash': commit_hash,
-            ':status': 'complete',
-            ':ts': timestamp
-        }
-    )
-    print(f"Updated orphaned record {event_id} with commitHash {commit_hash}")
+def link_orphaned_record(event_id, commit_event_id, commit_hash, audit_record, project_id, branch, author, timestamp):
+    """
+    Bind commitHash to an existing uncommitted record, delete its pending pointer, and write
+    the audit records and project activity update as one TransactWriteItems call.
+    The record update only applies while commitHash is still null, so a commit never
+    overwrites one that is already linked — returns False in that case (no orphan).
+    The commit event's own audit entry is written once; if an earlier delivery already wrote
+    it, the link is already done and True is returned without writing anything.
+    The pointer delete only applies while the pointer still names this record; if a newer
+    uncommitted record has replaced it, the link is written without touching the pointer.
+    """
+    event_audit_record = dict(audit_record, entityId=commit_event_id, linkedEventId=event_id)
+    link_items = [
+        {'Update': {
+            'TableName': CONTEXT_TABLE,
+            'Key': _marshal({'eventId': event_id}),
+            'UpdateExpression': 'SET commitHash = :hash, #status = :status, committedAt = :ts',
+            'ConditionExpression': 'attribute_type(commitHash, :nulltype)',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': _marshal({
+                ':hash': commit_hash, ':status': 'complete', ':ts': timestamp, ':nulltype': 'NULL'
+            }),
+        }},
+        {'Put': {'TableName': AUDIT_TABLE, 'Item': _marshal(audit_record)}},
+        {'Put': {'TableName': AUDIT_TABLE, 'Item': _marshal(event_audit_record), 'ConditionExpression': _AUDIT_ONCE}},
+        {'Update': {
+            'TableName': PROJECTS_TABLE,
+            'Key': _marshal({'projectId': project_id}),
+            'UpdateExpression': 'SET lastActivityAt = :ts ADD eventCount :inc',
+            'ExpressionAttributeValues': _marshal({':ts': timestamp, ':inc': 1}),
+        }},
+    ]
+    pointer_delete = {'Delete': {
+        'TableName': CONTEXT_TABLE,
+        'Key': _marshal({'eventId': pending_record_key(project_id, branch, author)}),
+        'ConditionExpression': 'pendingEventId = :id',
+        'ExpressionAttributeValues': _marshal({':id': event_id}),
+    }}
+    # Cancellation reasons are positional: [record update, orphan audit, event audit, project update, pointer delete]
+    for transact_items in (link_items + [pointer_delete], link_items):
+        try:
+            _ddb_client().transact_write_items(TransactItems=transact_items)
+            break
+        except ClientError as e:
+            reasons = _cancellation_reasons(e)
+            if reasons[2:3] == ['ConditionalCheckFailed']:
+                logger.info(f"Commit event {commit_event_id} was already linked by an earlier delivery")
+                return True
+            if reasons[:1] == ['ConditionalCheckFailed']:
+                logger.info(f"Record {event_id} was already linked to a commit")
+                return False
+            # Only the pointer condition failed — retry once without the pointer delete
+            if transact_items is link_items or reasons[-1:] != ['ConditionalCheckFailed'] \
+                    or any(code != 'None' for code in reasons[1:-1]):
+                raise
+    logger.info(f"Updated orphaned record {event_id} with commitHash {commit_hash}")
+    return True
 
-def publish_cloudwatch_metric(metric_name, value, project_id):
-    """Publish a custom CloudWatch metric for monitoring."""
+def record_metric(metric_name, value, unit='Count'):
+    """Queue a custom CloudWatch metric; all metrics for the invocation are published together."""
+    _pending_metrics.append({
+        'MetricName': metric_name,
+        'Dimensions': [{'Name': 'ProjectId', 'Value': _metric_project_id}],
+        'Value': value,
+        'Unit': unit,
+        'Timestamp': datetime.now(timezone.utc),
+    })
+
+def flush_metrics():
+    """Publish every queued metric in a single put_metric_data call (non-fatal)."""
+    if not _pending_metrics:
+        return
+    metric_data = list(_pending_metrics)
+    _pending_metrics.clear()
     try:
-        cloudwatch.put_metric_data(
-            Namespace='FlowSync',
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': 'Count',
-                    'Timestamp': datetime.utcnow(),
-                    'Dimensions': [
-                        {
-                            'Name': 'ProjectId',
-                            'Value': project_id
-                        }
-                    ]
-                }
-            ]
-        )
-        print(f"Published CloudWatch metric: {metric_name} = {value}")
+        _cw().put_metric_data(Namespace='FlowSync', MetricData=metric_data)
+        logger.info(f"Published {len(metric_data)} CloudWatch metrics: {', '.join(m['MetricName'] for m in metric_data)}")
     except Exception as e:
-        print(f"Failed to publish CloudWatch metric: {str(e)}")
+        logger.warning(f"Failed to publish CloudWatch metrics: {str(e)}")
 
 def propagate_branch_context(project_id, source_branch, target_branch, timestamp):
     """Copy all completed context records from source_branch to target_branch on merge."""
-    table = dynamodb.Table(CONTEXT_TABLE)
-
     all_records = []
     kwargs = {
         'IndexName': 'BranchContextIndex',
@@ -289,7 +678,7 @@ def propagate_branch_context(project_id, source_branch, target_branch, timestamp
         }
     }
     while True:
-        response = table.query(**kwargs)
+        response = _context_table().query(**kwargs)
         # Only propagate non-failed records
         all_records.extend(r for r in response.get('Items', []) if r.get('status') != 'failed')
         last_key = response.get('LastEvaluatedKey')
@@ -298,51 +687,117 @@ def propagate_branch_context(project_id, source_branch, target_branch, timestamp
         kwargs['ExclusiveStartKey'] = last_key
 
     if not all_records:
-        print(f"[propagate] No records for branch '{source_branch}' — nothing to propagate")
+        logger.info(f"[propagate] No records for branch '{source_branch}' — nothing to propagate")
         return 0
 
+    copied = 0
     for record in all_records:
         new_record = dict(record)
-        new_record['eventId']           = str(uuid.uuid4())
+        new_record['eventId']           = str(uuid.uuid5(_PROPAGATION_NAMESPACE, f"{record['eventId']}#{target_branch}"))
         new_record['branch']            = target_branch
         new_record['branchExtractedAt'] = f"{target_branch}#{timestamp}"
         new_record['mergedFrom']        = source_branch
         new_record['extractedAt']       = timestamp
-        table.put_item(Item=new_record)
+        try:
+            _context_table().put_item(Item=new_record, ConditionExpression='attribute_not_exists(eventId)')
+            copied += 1
+        except ClientError as e:
+            # Already copied by an earlier delivery (or an earlier merge of the same branches)
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
 
-    print(f"[propagate] Copied {len(all_records)} records: '{source_branch}' → '{target_branch}'")
-    return len(all_records)
+    logger.info(f"[propagate] Copied {copied} of {len(all_records)} records: '{source_branch}' → '{target_branch}'")
+    return copied
 
 
 def handler(event, context):
-    print("AI Processing Lambda invoked", json.dumps(event))
+    # Full payload dumps only on a sampled fraction of invocations
+    logger.setLevel(logging.DEBUG if random.random() < DEBUG_SAMPLE_RATE else logging.INFO)
+    try:
+        return process_event(event)
+    finally:
+        flush_metrics()
+
+
+def process_handler(event, context):
+    """SQS worker entry point: run each queued ingestion event through process_event().
+
+    Records that raise or come back with a 5xx (transient errors) are reported as batch item
+    failures so SQS redelivers only those, and dead-letters them after maxReceiveCount.
+    Schema failures come back as 422 and are not retried. Records that no longer fit in the
+    remaining invocation time are handed back unprocessed. If a slow record still times the
+    invocation out, SQS redelivers the whole batch; records that already committed are
+    detected by their audit entry (already_processed, conditional audit Puts) and skipped.
+    A plain event (direct invoke, e.g. test-event.json) is processed as a single event by handler().
+    """
+    if "Records" not in event:
+        logger.info("Non-SQS event received, processing it as a single event")
+        return handler(event, context)
+    logger.setLevel(logging.DEBUG if random.random() < DEBUG_SAMPLE_RATE else logging.INFO)
+    failures = []
+    try:
+        for record in event.get("Records", []):
+            if context is not None and context.get_remaining_time_in_millis() < RECORD_TIME_BUDGET_MS:
+                failures.append({"itemIdentifier": record["messageId"]})
+                continue
+            try:
+                result = process_event(_json_loads(record["body"]))
+                if result.get("statusCode", 200) >= 500:
+                    failures.append({"itemIdentifier": record["messageId"]})
+            except Exception as e:
+                logger.error(f"Failed to process SQS message {record.get('messageId')}: {str(e)}")
+                failures.append({"itemIdentifier": record["messageId"]})
+    finally:
+        # One put_metric_data for the whole batch
+        flush_metrics()
+    return {"batchItemFailures": failures}
+
+
+def process_event(event):
+    """Process one ingestion event: merge propagation, orphan linking, or full extraction."""
+    global _metric_project_id
+    logger.info(
+        f"AI Processing Lambda invoked eventId={event.get('eventId')} projectId={event.get('projectId')}",
+        extra={'eventId': event.get('eventId'), 'projectId': event.get('projectId')}
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Event payload: {json.dumps(event)}")
     project_id = event.get("projectId", "test-project")
+    _metric_project_id = project_id   # ProjectId dimension for metrics recorded below
 
     # ── Branch merge propagation path ──
     # Triggered by Ingestion Lambda when a merge commit is detected.
     if event.get('propagate'):
         source_branch = event.get('sourceBranch')
         target_branch = event.get('targetBranch')
-        timestamp     = event.get('timestamp', datetime.utcnow().isoformat() + 'Z')
+        timestamp     = event.get('timestamp') or utc_now_iso()
         if not source_branch or not target_branch:
             return {'statusCode': 400, 'body': json.dumps({'error': 'sourceBranch and targetBranch required'})}
         try:
             count = propagate_branch_context(project_id, source_branch, target_branch, timestamp)
-            update_project_activity(project_id, timestamp)
+            record_propagation(project_id, source_branch, target_branch, timestamp, count)
             return {'statusCode': 200, 'body': json.dumps({'propagated': count, 'from': source_branch, 'to': target_branch})}
         except Exception as e:
-            print(f"[propagate] Error: {e}")
+            logger.error(f"[propagate] Error: {e}")
             return {'statusCode': 500, 'body': json.dumps({'error': str(e)})}
 
     try:
         # Day 1: Use hardcoded diff for initial test
         # Extract all fields from the event payload (forwarded by Ingestion Lambda)
         payload      = event.get("payload", event)   # support both wrapped and flat
+        event_id     = event.get("eventId", "test-event")
         diff         = payload.get("diff") or event.get("diff") or "diff --git a/file.txt b/file.txt\n..."
         commit_hash  = payload.get("commitHash") or event.get("commitHash", None)
         branch       = event.get("branch", "main")
         author       = payload.get("author") or event.get("author", "unknown")
-        timestamp    = event.get("timestamp", datetime.utcnow().isoformat() + "Z")
+        timestamp    = event.get("timestamp") or utc_now_iso()
+        try:
+            timestamp_ms = iso_to_epoch_ms(timestamp)   # parsed once; window math is integer-only
+        except (TypeError, ValueError):
+            # A malformed client timestamp must not fail the event — record it at processing time
+            logger.warning(f"Unparseable event timestamp {timestamp!r}, using current time")
+            timestamp = utc_now_iso()
+            timestamp_ms = iso_to_epoch_ms(timestamp)
         parent_branch = event.get("parentBranch", None)
         changed_files = payload.get("changedFiles", [])
         message       = payload.get("message") or event.get("message", "")
@@ -352,14 +807,21 @@ def handler(event, context):
             "author": author, "branch": branch, "changedFiles": changed_files
         }
 
+        # Redelivered after its writes committed (e.g. the rest of its SQS batch timed out)
+        if already_processed(event_id, timestamp):
+            logger.info(f"Event {event_id} already processed, skipping")
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"message": "Event already processed", "eventId": event_id})
+            }
+
         # Direction B: Check for orphaned record if this is a commit event
         if commit_hash:
-            orphaned = find_orphaned_record(project_id, branch, author, timestamp)
+            orphaned = find_orphaned_record(project_id, branch, author, timestamp_ms)
             if orphaned:
-                # Update existing record with commitHash instead of creating new one
-                update_orphaned_record(orphaned['eventId'], commit_hash, timestamp)
-                
-                # Write audit record
+                # Update existing record with commitHash instead of creating new one,
+                # atomically with the audit record and project activity update
                 audit_record = {
                     "entityId": orphaned['eventId'],
                     "action": "commit_linked",
@@ -368,35 +830,38 @@ def handler(event, context):
                     "branch": branch,
                     "author": author
                 }
-                write_audit_record(audit_record)
-                
-                # Update project activity
-                update_project_activity(project_id, timestamp)
-                
-                return {
-                    "statusCode": 200,
-                    "headers": {"Content-Type": "application/json"},
-                    "body": json.dumps({
-                        "message": "Orphaned record updated with commitHash",
-                        "eventId": orphaned['eventId']
-                    })
-                }
+                # Linked by another commit since the lookup → no orphan, extract as usual
+                if link_orphaned_record(orphaned['eventId'], event_id, commit_hash, audit_record, project_id, branch, author, timestamp):
+                    record_metric('OrphanedLinked', 1)
+
+                    return {
+                        "statusCode": 200,
+                        "headers": {"Content-Type": "application/json"},
+                        "body": json.dumps({
+                            "message": "Orphaned record updated with commitHash",
+                            "eventId": orphaned['eventId']
+                        })
+                    }
 
         # Call Bedrock for extraction
         t_handler_start = time.time()
         extraction = call_bedrock(event_data)
         bedrock_ms = extraction.pop('_bedrock_duration_ms', 0)
+        model_used = extraction.pop('_model_used', MODEL_ID)
+        diff_tier = extraction.pop('_diff_tier', 'complex')
         validate_extraction_schema(extraction)
         extraction['confidence'] = compute_confidence(extraction)
 
-        # Generate Titan embedding
-        embedding_input = json.dumps(extraction)
-        embedding, embedding_ms = call_titan_embedding(embedding_input)
+        # Generate Titan embedding — extraction is deterministic (temperature 0), so the
+        # serialized extraction doubles as the embedding cache key
+        embedding_input = json.dumps(extraction, default=float)
+        packed_embedding, embedding_ms = call_titan_embedding(embedding_input)
+        embedding, embedding_scale = quantize_embedding(packed_embedding)
         total_ms = int((time.time() - t_handler_start) * 1000)
 
         # Build context record — matches flowsync-context schema exactly
         context_record = {
-            "eventId":            event.get("eventId", "test-event"),
+            "eventId":            event_id,
             "projectId":          project_id,
             "branch":             branch,
             "branchExtractedAt":  f"{branch}#{timestamp}",   # BranchContextIndex GSI SK
@@ -408,24 +873,39 @@ def handler(event, context):
             "tasks":              extraction["tasks"],
             "stage":              extraction["stage"],
             "risk":               extraction["risk"],
-            "confidence":         extraction["confidence"],
+            "confidence":         Decimal(str(extraction["confidence"])),
             "entities":           extraction["entities"],
             "author":             author,
             "agentReasoning":     None,
-            "modelVersion":       MODEL_ID,
-            "embedding":          embedding,
-            "extractedAt":        timestamp,
+            "modelVersion":       model_used,
+            "embedding":          embedding,        # int8, dequantize with embeddingScale
+            "embeddingScale":     embedding_scale,
+            "extractedAt":        timestamp,        # ISO string — ProjectContextIndex SK
+            "extractedAtMs":      timestamp_ms,
             "processingDuration": total_ms
         }
-        write_context_record(context_record)
+        audit_record = {
+            "entityId": context_record["eventId"],
+            "action": "context_extracted",
+            "timestamp": timestamp,
+            "projectId": project_id,
+            "branch": branch,
+            "author": author
+        }
+
+        if write_extraction_records(context_record, audit_record, project_id, timestamp):
+            record_metric('Extractions', 1)
+            record_metric('ProcessingDurationMs', total_ms, unit='Milliseconds')
 
-        # Emit structured benchmark log — parsed by the benchmark agent
+        # Emit structured benchmark log — parsed by the benchmark agent, so kept as a bare stdout line
         print(json.dumps({
             "BENCHMARK_LOG": True,
             "eventId":        context_record["eventId"],
             "projectId":      project_id,
             "branch":         branch,
             "author":         author,
+            "model":          model_used,
+            "diff_tier":      diff_tier,
             "bedrock_ms":     bedrock_ms,
             "embedding_ms":   embedding_ms,
             "total_ms":       total_ms,
@@ -438,20 +918,6 @@ def handler(event, context):
             "timestamp":      timestamp
         }))
 
-        # Write audit record
-        audit_record = {
-            "entityId": context_record["eventId"],
-            "action": "context_extracted",
-            "timestamp": timestamp,
-            "projectId": project_id,
-            "branch": branch,
-            "author": author
-        }
-        write_audit_record(audit_record)
-
-        # Update project activity
-        update_project_activity(project_id, timestamp)
-
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
@@ -459,8 +925,8 @@ def handler(event, context):
         }
     except ValueError as e:
         # Schema validation or embedding failure
-        print(f"SCHEMA_VALIDATION_ERROR: {str(e)}")
-        publish_cloudwatch_metric('SchemaValidationFailure', 1, project_id)
+        logger.error(f"SCHEMA_VALIDATION_ERROR: {str(e)}")
+        record_metric('SchemaValidationFailure', 1)
         
         # Mark event as failed
         failed_record = {
@@ -472,14 +938,15 @@ def handler(event, context):
         }
         write_context_record(failed_record)
         
+        # 422, not 500 — deterministic, so the SQS worker must not retry it
         return {
-            "statusCode": 500,
+            "statusCode": 422,
             "headers": {"Content-Type": "application/json"},
             "body": json.dumps({"error": f"Schema validation failed: {str(e)}"})
         }
     except Exception as e:
-        print(f"Error in AI Processing Lambda: {str(e)}")
-        publish_cloudwatch_metric('ProcessingFailure', 1, project_id)
+        logger.error(f"Error in AI Processing Lambda: {str(e)}")
+        record_metric('ProcessingFailure', 1)
         
         return {
             "statusCode": 500,
@@ -46,6 +46,7 @@ try:
         call_titan_embedding,
         cosine_similarity,
         convert_decimals,
+        decode_embedding,
         search_context_rag
     )
 except ImportError:
@@ -62,6 +63,10 @@ except ImportError:
         """Stub: Convert Decimal objects"""
         return obj
     
+    def decode_embedding(raw_embedding, scale=None):
+        """Stub: Decode stored embedding"""
+        raise NotImplementedError("flowsync_common.helpers not available")
+    
     def search_context_rag(*args, **kwargs):
         """Stub: RAG pipeline"""
         raise NotImplementedError("flowsync_common.helpers not available")
@@ -264,7 +269,7 @@ def retrieve_relevant_context(project_id: str, query: str) -> List[Dict]:
             raw_embedding = record.get('embedding')
             if not raw_embedding:
                 continue
-            embedding = [float(x) for x in raw_embedding]
+            embedding = decode_embedding(raw_embedding, record.get('embeddingScale'))
             if len(embedding) != 1536:
                 continue
             score = cosine_similarity(query_embedding, embedding)
@@ -19,7 +19,7 @@ const { DynamoDBClient }            = require('@aws-sdk/client-dynamodb');
 const { DynamoDBDocumentClient,
         PutCommand, GetCommand }    = require('@aws-sdk/lib-dynamodb');
 const { S3Client, PutObjectCommand} = require('@aws-sdk/client-s3');
-const { LambdaClient, InvokeCommand}= require('@aws-sdk/client-lambda');
+const { SQSClient, SendMessageCommand } = require('@aws-sdk/client-sqs');
 const crypto                        = require('crypto');           // Node.js built-in
 
 // ── Config — from Lambda environment variables set by CDK ──────────────────
@@ -27,7 +27,7 @@ const PROJECTS_TABLE  = process.env.PROJECTS_TABLE;               // flowsync-pr
 const EVENTS_TABLE    = process.env.EVENTS_TABLE;                 // flowsync-events
 const AUDIT_TABLE     = process.env.AUDIT_TABLE;                  // flowsync-audit
 const RAW_EVENTS_BUCKET = process.env.RAW_EVENTS_BUCKET;          // flowsync-raw-events-{account}
-const AI_FUNCTION     = process.env.AI_PROCESSING_FUNCTION_NAME;  // flowsync-ai-processing
+const AI_QUEUE_URL    = process.env.AI_PROCESSING_QUEUE_URL;      // flowsync-ai-processing-queue
 
 // ── Singleton SDK clients ───────────────────────────────────────────────────
 // Created once per cold-start and reused across warm invocations (AWS best practice).
@@ -36,7 +36,7 @@ const dynamo = DynamoDBDocumentClient.from(
   { marshallOptions: { removeUndefinedValues: true } },  // prevents SerializationException on undefined attrs
 );
 const s3     = new S3Client({ region: 'us-east-1' });
-const lambda = new LambdaClient({ region: 'us-east-1' });
+const sqs    = new SQSClient({ region: 'us-east-1' });
 
 // ── Validation regex ────────────────────────────────────────────────────────
 const UUID_V4     = /^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$/i;
@@ -218,7 +218,7 @@ async function createProject(body) {
 
 // ─────────────────────────────────────────────────────────────────────────────
 // ROUTE: POST /api/v1/events
-// Validates → writes to DynamoDB → archives to S3 → invokes AI Lambda → returns.
+// Validates → writes to DynamoDB → archives to S3 → enqueues for AI processing → returns.
 // SLA: response within 500 ms (returns after DynamoDB write, not after AI).
 // ─────────────────────────────────────────────────────────────────────────────
 async function ingestEvent(headers, body) {
@@ -264,14 +264,13 @@ async function ingestEvent(headers, body) {
     }));
   } catch (err) { console.error('[non-fatal] S3 archive failed:', err.message); }
 
-  // ── Non-fatal: AI Processing Lambda (fire-and-forget) ──
-  // InvocationType: 'Event' → Lambda queues it and returns HTTP 202 instantly.
-  // We do NOT wait — this is what keeps us inside the 500 ms SLA.
+  // ── Non-fatal: AI Processing hand-off (fire-and-forget) ──
+  // One SQS send_message → HTTP 202 instantly; the AI worker drains the queue in batches.
+  // We do NOT wait on extraction — this is what keeps us inside the 500 ms SLA.
   try {
-    await lambda.send(new InvokeCommand({
-      FunctionName: AI_FUNCTION,
-      InvocationType: 'Event',
-      Payload: Buffer.from(JSON.stringify({       // SDK v3 requires Buffer/Uint8Array, not raw string
+    await sqs.send(new SendMessageCommand({
+      QueueUrl: AI_QUEUE_URL,
+      MessageBody: JSON.stringify({
         eventId:      event.eventId,
         projectId:    event.projectId,
         eventType:    event.eventType,
@@ -279,27 +278,26 @@ async function ingestEvent(headers, body) {
         parentBranch: event.payload.parentBranch ?? null,
         payload:      event.payload,
         timestamp:    event.timestamp,
-      })),
+      }),
     }));
-  } catch (err) { console.error('[non-fatal] AI invoke failed:', err.message); }
+  } catch (err) { console.error('[non-fatal] AI enqueue failed:', err.message); }
 
   // ── Non-fatal: Branch merge propagation (fire-and-forget) ──
   // When a merge commit is pushed, copy all source-branch context records to the target branch.
   if (event.payload?.isMerge && event.payload?.sourceBranch) {
     try {
-      await lambda.send(new InvokeCommand({
-        FunctionName: AI_FUNCTION,
-        InvocationType: 'Event',
-        Payload: Buffer.from(JSON.stringify({
+      await sqs.send(new SendMessageCommand({
+        QueueUrl: AI_QUEUE_URL,
+        MessageBody: JSON.stringify({
           propagate:    true,
           projectId:    event.projectId,
           sourceBranch: event.payload.sourceBranch,
           targetBranch: event.branch,
           timestamp:    event.timestamp,
-        })),
+        }),
       }));
       console.log(`[merge-propagate] queued propagation: ${event.payload.sourceBranch} → ${event.branch}`);
-    } catch (err) { console.error('[non-fatal] Merge propagation invoke failed:', err.message); }
+    } catch (err) { console.error('[non-fatal] Merge propagation enqueue failed:', err.message); }
   }
   try {
     await dynamo.send(new PutCommand({
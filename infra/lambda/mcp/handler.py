@@ -11,7 +11,7 @@ import base64
 from datetime import datetime, timedelta
 from decimal import Decimal
 from botocore.config import Config as BotoConfig
-from flowsync_common.helpers import respond, strip_embeddings, search_context_rag, convert_floats_to_decimal, call_titan_embedding
+from flowsync_common.helpers import respond, strip_embeddings, search_context_rag, convert_floats_to_decimal, call_titan_embedding, encode_embedding
 
 # Environment variables
 CONTEXT_TABLE = os.environ.get("CONTEXT_TABLE", "flowsync-context")
@@ -309,10 +309,11 @@ def log_context(params):
                     'agentReasoning': reasoning,
                 })
                 new_embedding = call_titan_embedding(embed_text, bedrock_client)
+                embedding, embedding_scale = encode_embedding(new_embedding)
                 table.update_item(
                     Key={'eventId': event_id},
-                    UpdateExpression='SET embedding = :emb',
-                    ExpressionAttributeValues={':emb': convert_floats_to_decimal(new_embedding)}
+                    UpdateExpression='SET embedding = :emb, embeddingScale = :scale',
+                    ExpressionAttributeValues={':emb': embedding, ':scale': embedding_scale}
                 )
                 print(f'[log_context] Re-embedded record {event_id} after enrichment')
             except Exception as emb_err:
@@ -355,12 +356,22 @@ def log_context(params):
                 'agentReasoning': reasoning,
                 'modelVersion': 'mcp-agent',
                 'embedding': None,
-                'extractedAt': timestamp
+                'extractedAt': timestamp,
+                'extractedAtMs': int(time_obj.timestamp() * 1000)   # same instant as extractedAt
             }
             
             orphaned_record = convert_floats_to_decimal(orphaned_record)
             table.put_item(Item=orphaned_record)
             
+            # Pending pointer — lets the AI Processing Lambda link the next commit with one get_item
+            # (key format must match pending_record_key in ai_processing/handler.py)
+            table.put_item(Item={
+                'eventId': f"PENDING#{project_id}#{branch}#{author}",
+                'pendingEventId': event_id,
+                'pendingSince': timestamp,
+                'pendingSinceMs': orphaned_record['extractedAtMs']
+            })
+            
             # Write audit record
             audit_table = dynamodb.Table(AUDIT_TABLE)
             audit_table.put_item(Item={
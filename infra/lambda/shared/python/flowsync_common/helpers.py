@@ -8,7 +8,9 @@ import os
 import hashlib
 import boto3
 import math
+from array import array
 from decimal import Decimal
+from boto3.dynamodb.types import Binary
 
 
 # Model configuration
@@ -63,6 +65,30 @@ def call_titan_embedding(text, bedrock_client):
     return embedding
 
 
+def encode_embedding(embedding):
+    """
+    Quantize an embedding to int8 with one per-vector scale for storage.
+    Returns (Binary, Decimal scale) — 1536 bytes vs ~25 KB as a number list.
+    """
+    peak = max(abs(v) for v in embedding)
+    scale = peak / 127 if peak else 1.0
+    quantized = array('b', [round(v / scale) for v in embedding])
+    return Binary(quantized.tobytes()), Decimal(str(scale))
+
+
+def decode_embedding(raw_embedding, scale=None):
+    """
+    Return a stored embedding as a list of floats. Handles int8 Binary + embeddingScale,
+    packed float32 Binary (no scale), and legacy lists of Decimals.
+    """
+    if isinstance(raw_embedding, Binary):
+        if scale is not None:
+            scale = float(scale)
+            return [q * scale for q in array('b', raw_embedding.value)]
+        return array('f', raw_embedding.value).tolist()
+    return [float(x) for x in raw_embedding]
+
+
 def cosine_similarity(vec_a, vec_b):
     """Calculate cosine similarity between two vectors."""
     dot = sum(a * b for a, b in zip(vec_a, vec_b))
@@ -74,7 +100,7 @@ def cosine_similarity(vec_a, vec_b):
 
 
 def strip_embeddings(records):
-    """Remove embedding field from context records (reduces response size by ~12KB per record)."""
+    """Remove embedding field from context records (binary embeddings are not JSON-serializable)."""
     if isinstance(records, dict):
         records = [records]
     for record in records:
@@ -187,7 +213,7 @@ def search_context_rag(project_id, query, branch, bedrock_client, dynamodb, cont
             'sources': []
         }
     
-    # Step 4: Compute similarities (convert Decimal embeddings to float)
+    # Step 4: Compute similarities (decode stored embeddings to float)
     # When no branch is specified, apply a 0.85× score penalty to non-main records
     # to prevent cross-branch pollution from dominating results.
     CROSS_BRANCH_PENALTY = 0.85
@@ -196,7 +222,7 @@ def search_context_rag(project_id, query, branch, bedrock_client, dynamodb, cont
         raw_embedding = record.get('embedding')
         if not raw_embedding:
             continue
-        embedding = [float(x) for x in raw_embedding]
+        embedding = decode_embedding(raw_embedding, record.get('embeddingScale'))
         if len(embedding) != 1536:
             continue
         score = cosine_similarity(query_embedding, embedding)
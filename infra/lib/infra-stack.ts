@@ -7,6 +7,8 @@ import * as cloudfront from 'aws-cdk-lib/aws-cloudfront';
 import * as origins from 'aws-cdk-lib/aws-cloudfront-origins';
 import * as s3deploy from 'aws-cdk-lib/aws-s3-deployment';
 import * as iam from 'aws-cdk-lib/aws-iam';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as lambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
 import { Construct } from 'constructs';
 import * as path from 'path';
 
@@ -92,7 +94,16 @@ export class InfraStack extends cdk.Stack {
       timeToLiveAttribute: 'expiresAt', // auto-expire cache entries after 1 hour
     });
 
-    const allTables = [projectsTable, eventsTable, contextTable, auditTable, chatSessionsTable, cacheTable];
+    // Titan embedding cache — keyed by sha256 of the embedding input text (7-day TTL)
+    const embeddingCacheTable = new dynamodb.Table(this, 'FlowSyncEmbeddingCache', {
+      tableName: 'flowsync-embedding-cache',
+      partitionKey: { name: 'hash', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      removalPolicy: cdk.RemovalPolicy.DESTROY,
+      timeToLiveAttribute: 'ttl',
+    });
+
+    const allTables = [projectsTable, eventsTable, contextTable, auditTable, chatSessionsTable, cacheTable, embeddingCacheTable];
 
     // ─────────────────────────────────────────────
     // S3 BUCKETS
@@ -105,6 +116,21 @@ export class InfraStack extends cdk.Stack {
       autoDeleteObjects: true,
     });
 
+    // ─────────────────────────────────────────────
+    // SQS: INGESTION → AI PROCESSING HAND-OFF
+    // ─────────────────────────────────────────────
+
+    const aiProcessingDlq = new sqs.Queue(this, 'FlowSyncAiProcessingDlq', {
+      queueName: 'flowsync-ai-processing-dlq',
+      retentionPeriod: cdk.Duration.days(14),
+    });
+
+    const aiProcessingQueue = new sqs.Queue(this, 'FlowSyncAiProcessingQueue', {
+      queueName: 'flowsync-ai-processing-queue',
+      visibilityTimeout: cdk.Duration.seconds(1800), // 6x the AI Processing timeout (AWS guidance)
+      deadLetterQueue: { queue: aiProcessingDlq, maxReceiveCount: 3 },
+    });
+
     // ─────────────────────────────────────────────
     // IAM: BEDROCK POLICY (for AI Processing Lambda)
     // ─────────────────────────────────────────────
@@ -155,26 +181,46 @@ export class InfraStack extends cdk.Stack {
         CONTEXT_TABLE: contextTable.tableName,
         AUDIT_TABLE: auditTable.tableName,
         RAW_EVENTS_BUCKET: rawEventsBucket.bucketName,
-        AI_PROCESSING_FUNCTION_NAME: 'flowsync-ai-processing',
+        AI_PROCESSING_QUEUE_URL: aiProcessingQueue.queueUrl,
       },
     });
 
     const aiProcessingFn = new lambda.Function(this, 'AiProcessingFn', {
       functionName: 'flowsync-ai-processing',
       runtime: lambda.Runtime.PYTHON_3_12,
-      handler: 'handler.handler',
-      code: lambda.Code.fromAsset(path.join(__dirname, '../lambda/ai_processing')),
-      timeout: cdk.Duration.seconds(60),
+      handler: 'handler.process_handler', // SQS worker; handler.handler processes one event
+      // Installs requirements.txt (orjson, msgspec) alongside handler.py — cdk synth/deploy needs Docker
+      code: lambda.Code.fromAsset(path.join(__dirname, '../lambda/ai_processing'), {
+        bundling: {
+          image: lambda.Runtime.PYTHON_3_12.bundlingImage,
+          command: ['bash', '-c', 'pip install -r requirements.txt -t /asset-output && cp -au . /asset-output'],
+        },
+      }),
+      timeout: cdk.Duration.seconds(300), // a batch of 10 runs serially; records are only started with 60 s left
       memorySize: 512,
       environment: {
         PROJECTS_TABLE: projectsTable.tableName,
         EVENTS_TABLE: eventsTable.tableName,
         CONTEXT_TABLE: contextTable.tableName,
         AUDIT_TABLE: auditTable.tableName,
+        EMBEDDING_CACHE_TABLE: embeddingCacheTable.tableName,
         FALLBACK_MODEL_ID: 'us.amazon.nova-lite-v1:0',
+        SIMPLE_MODEL_ID: 'us.amazon.nova-lite-v1:0',
       },
     });
     aiProcessingFn.addToRolePolicy(bedrockPolicy);
+    aiProcessingFn.addEventSource(new lambdaEventSources.SqsEventSource(aiProcessingQueue, {
+      batchSize: 10,
+      maxBatchingWindow: cdk.Duration.seconds(1),
+      reportBatchItemFailures: true, // process_handler returns batchItemFailures
+    }));
+    // Custom FlowSync metrics (batched into one put_metric_data per invocation)
+    aiProcessingFn.addToRolePolicy(new iam.PolicyStatement({
+      effect: iam.Effect.ALLOW,
+      actions: ['cloudwatch:PutMetricData'],
+      resources: ['*'],
+      conditions: { StringEquals: { 'cloudwatch:namespace': 'FlowSync' } },
+    }));
 
     const mcpFn = new lambda.Function(this, 'McpFn', {
       functionName: 'flowsync-mcp',
@@ -241,8 +287,8 @@ export class InfraStack extends cdk.Stack {
     // Grant S3 permissions
     rawEventsBucket.grantPut(ingestionFn);
 
-    // Grant Ingestion Lambda permission to invoke AI Processing Lambda
-    aiProcessingFn.grantInvoke(ingestionFn);
+    // Grant Ingestion Lambda permission to enqueue events for AI Processing
+    aiProcessingQueue.grantSendMessages(ingestionFn);
 
     // ─────────────────────────────────────────────
     // API GATEWAY (REST API)